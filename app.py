@@ -3,15 +3,24 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
+import diskcache
+from cachetools import TTLCache
 import pydeck as pdk
 import plotly.express as px
-from datetime import datetime, timedelta
-from krigging import perform_kriging_correct, get_aqi_at_location
+from datetime import datetime
+from krigging import perform_kriging_correct
 import geopandas as gpd
-from shapely.geometry import Point
+import shapely
+from scipy.spatial import cKDTree
+import io
 import os
-import re
+import tempfile
+import bisect
 import time
+import threading
 import json
 import traceback
 
@@ -30,14 +39,91 @@ SMS_THROTTLE_SECONDS = 300  # 5 minutes per number by default
 # -------------------------
 # UTILITIES: Phone validation, send_sms wrapper (SMS77 + optional Twilio fallback)
 # -------------------------
-PHONE_REGEX = re.compile(r"^\+\d{7,15}$")  # simple E.164-like check (must start with + and digits, length 7-15 digits)
+@st.cache_resource
+def get_http_session():
+    """Process-wide requests.Session so SMS and API calls reuse pooled TCP/TLS connections."""
+    session = requests.Session()
+    session.headers["Accept-Encoding"] = "gzip"
+    session.headers["User-Agent"] = f"delhi-aqi-dashboard {requests.utils.default_user_agent()}"
+    # Retry transient errors on the idempotent WAQI / Open-Meteo GETs with exponential backoff.
+    # raise_on_status=False hands the last response back so callers can report the error text.
+    # Retry-After is ignored: a large value would block the script thread for the whole wait.
+    get_retry = Retry(total=2, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset({"GET"}), raise_on_status=False,
+                      respect_retry_after_header=False)
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=get_retry))
+    # SMS POSTs are only retried when the connection was never made; after a read timeout, dropped
+    # connection or error status the provider may already have accepted the message.
+    post_retry = Retry(total=2, connect=2, read=0, status=0, other=0, backoff_factor=0.3,
+                       allowed_methods=frozenset({"POST"}), raise_on_status=False,
+                       respect_retry_after_header=False)
+    for sms_host in ("https://gateway.sms77.io", "https://api.twilio.com"):
+        session.mount(sms_host, HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=post_retry))
+    return session
+
+@st.cache_resource
+def get_disk_cache():
+    """On-disk cache for raw API payloads so a process restart does not re-hit WAQI / Open-Meteo."""
+    return diskcache.Cache(os.path.join(tempfile.gettempdir(), "aqi_http_cache"))
+
+@st.cache_resource
+def get_refresh_registry():
+    """URLs with a background refresh in flight (shared across sessions) and the lock guarding them."""
+    return set(), threading.Lock()
+
+def _fetch_json_into_cache(session, cache, url, ttl, timeout):
+    response = session.get(url, timeout=timeout)
+    response.raise_for_status()
+    data = orjson.loads(response.content)
+    # Entries stay readable for 2*ttl: the second ttl is the stale-while-revalidate window
+    cache.set(f"swr:{url}", (data, time.time()), expire=2 * ttl)
+    return data
+
+def _refresh_json_in_background(session, cache, url, ttl, timeout):
+    inflight, lock = get_refresh_registry()
+    with lock:
+        if url in inflight:
+            return
+        inflight.add(url)
+
+    def worker():
+        try:
+            _fetch_json_into_cache(session, cache, url, ttl, timeout)
+        except Exception:
+            pass  # keep serving the stale payload; the next read past ttl retries
+        finally:
+            with lock:
+                inflight.discard(url)
+
+    threading.Thread(target=worker, daemon=True).start()
+
+def cached_get_json(url, ttl, timeout):
+    """
+    GET url and decode JSON, persisting the payload on disk.
+    Once a payload is older than ttl it is still returned immediately while a
+    background thread refetches it, so only a cold cache blocks on the network.
+    """
+    session, cache = get_http_session(), get_disk_cache()
+    entry = cache.get(f"swr:{url}")
+    if entry is None:
+        return _fetch_json_into_cache(session, cache, url, ttl, timeout)
+    data, fetched_at = entry
+    if time.time() - fetched_at > ttl:
+        _refresh_json_in_background(session, cache, url, ttl, timeout)
+    return data
+
+# Simple E.164-like check: '+' followed by 7-15 ASCII digits
+PHONE_MIN_DIGITS, PHONE_MAX_DIGITS = 7, 15
 
 def validate_phone_number(phone: str) -> bool:
     """Simple validation - phone must be in +<countrycode><number> format (digits only after +)."""
     if not isinstance(phone, str):
         return False
     phone = phone.strip()
-    return bool(PHONE_REGEX.match(phone))
+    digits = phone[1:]
+    # str methods run in C; isascii() rules out non-ASCII digits that isdigit() would accept
+    return (phone[:1] == "+" and PHONE_MIN_DIGITS <= len(digits) <= PHONE_MAX_DIGITS
+            and digits.isascii() and digits.isdigit())
 
 def _sms77_send_once(phone: str, message: str, api_key: str, timeout=10):
     """
@@ -54,7 +140,7 @@ def _sms77_send_once(phone: str, message: str, api_key: str, timeout=10):
         "X-Api-Key": api_key
     }
     try:
-        resp = requests.post(url, data=payload, headers=headers, timeout=timeout)
+        resp = get_http_session().post(url, data=payload, headers=headers, timeout=timeout)
         # SMS77 returns 200 even on some failures; attempt to parse JSON
         text = resp.text
         try:
@@ -91,7 +177,7 @@ def _twilio_send_once(phone: str, message: str, account_sid: str, auth_token: st
             "From": from_number,
             "Body": message
         }
-        resp = requests.post(url, data=payload, auth=(account_sid, auth_token), timeout=timeout)
+        resp = get_http_session().post(url, data=payload, auth=(account_sid, auth_token), timeout=timeout)
         if resp.status_code in (200, 201):
             return True, resp.text
         else:
@@ -99,12 +185,50 @@ def _twilio_send_once(phone: str, message: str, account_sid: str, auth_token: st
     except Exception as e:
         return False, f"Exception: {str(e)}"
 
-def send_sms(phone: str, message: str, max_retries=2):
+@st.cache_resource
+def get_sms_throttle():
+    """Process-wide phone -> last-send time (shared by all sessions/tabs); entries expire after the throttle window."""
+    return TTLCache(maxsize=10000, ttl=SMS_THROTTLE_SECONDS), threading.Lock()
+
+def _throttle_wait(last_sent, now_ts) -> int:
+    if last_sent is None:
+        return 0
+    remaining = SMS_THROTTLE_SECONDS - (now_ts - last_sent)
+    return max(1, int(remaining)) if remaining > 0 else 0
+
+def sms_throttle_remaining(phone: str, now_ts=None) -> int:
+    """Seconds until this phone may receive another SMS (0 if not throttled)."""
+    now_ts = time.time() if now_ts is None else now_ts
+    last_sent_by_phone, lock = get_sms_throttle()
+    with lock:
+        last_sent = last_sent_by_phone.get(phone.strip())
+    return _throttle_wait(last_sent, now_ts)
+
+def _reserve_sms_slot(phone: str, now_ts: float) -> int:
+    """
+    Atomically claim the throttle slot for phone before sending.
+    Returns 0 if the slot was claimed, otherwise the seconds left to wait.
+    """
+    last_sent_by_phone, lock = get_sms_throttle()
+    with lock:
+        wait_secs = _throttle_wait(last_sent_by_phone.get(phone), now_ts)
+        if not wait_secs:
+            last_sent_by_phone[phone] = now_ts
+    return wait_secs
+
+def _release_sms_slot(phone: str, now_ts: float):
+    """Drop a reservation after every provider failed, unless a later send already replaced it."""
+    last_sent_by_phone, lock = get_sms_throttle()
+    with lock:
+        if last_sent_by_phone.get(phone) == now_ts:
+            last_sent_by_phone.pop(phone, None)
+
+def send_sms(phone: str, message: str):
     """
     High-level send SMS wrapper:
       - Validates number
-      - Throttles repeated sends per phone (session-state)
-      - Attempts SMS77 (with retries)
+      - Throttles repeated sends per phone (process-wide TTL cache)
+      - Attempts SMS77 (only failed connection attempts are retried by the shared session)
       - Falls back to Twilio if SMS77 fails and Twilio creds present
       - Returns (success_bool, provider_name, response_text)
     """
@@ -113,46 +237,34 @@ def send_sms(phone: str, message: str, max_retries=2):
     if not validate_phone_number(phone):
         return False, "validation", "Invalid phone number format. Use +<countrycode><number> (e.g. +919876543210)."
 
-    # Throttle check (session-state)
+    # Reserve the throttle slot before sending (process-wide and atomic, so concurrent tabs
+    # or sessions cannot both pass the check); it is released again if every provider fails
     now_ts = time.time()
-    if "sms_last_sent" not in st.session_state:
-        st.session_state["sms_last_sent"] = {}
-    last_sent = st.session_state["sms_last_sent"].get(phone, 0)
-    if now_ts - last_sent < SMS_THROTTLE_SECONDS:
-        wait_secs = int(SMS_THROTTLE_SECONDS - (now_ts - last_sent))
+    wait_secs = _reserve_sms_slot(phone, now_ts)
+    if wait_secs:
         return False, "throttle", f"Throttled: Please wait {wait_secs} seconds before requesting another SMS to this number."
 
     # Try SMS77
     if SMS77_API_KEY:
-        attempt = 0
-        while attempt <= max_retries:
-            success, resp = _sms77_send_once(phone, message, SMS77_API_KEY)
-            if success:
-                st.session_state["sms_last_sent"][phone] = now_ts
-                return True, "sms77", resp
-            # retry on transient network errors (simple heuristic)
-            attempt += 1
-            time.sleep(1)
-        # SMS77 ultimately failed
+        success, resp = _sms77_send_once(phone, message, SMS77_API_KEY)
+        if success:
+            return True, "sms77", resp
         sms77_error = resp
     else:
         sms77_error = "SMS77 API key not configured."
 
     # Fallback to Twilio if configured
     if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN and TWILIO_PHONE_NUMBER:
-        attempt = 0
-        while attempt <= max_retries:
-            success, resp = _twilio_send_once(phone, message, TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER)
-            if success:
-                st.session_state["sms_last_sent"][phone] = now_ts
-                return True, "twilio", resp
-            attempt += 1
-            time.sleep(1)
+        success, resp = _twilio_send_once(phone, message, TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER)
+        if success:
+            return True, "twilio", resp
         # Twilio failed as well
+        _release_sms_slot(phone, now_ts)
         twilio_err = resp
         return False, "both_failed", f"SMS77 error: {sms77_error} | Twilio error: {twilio_err}"
     else:
         # Twilio not configured, return SMS77 failure reason
+        _release_sms_slot(phone, now_ts)
         return False, "sms77_failed", f"SMS77 error: {sms77_error}"
 
 # -------------------------
@@ -165,98 +277,152 @@ DELHI_BOUNDS = "28.404,76.840,28.883,77.349"
 DELHI_LAT = 28.6139
 DELHI_LON = 77.2090
 
-# ---------- Delhi polygon loader (unchanged except guard)
+# ---------- Delhi polygon loader: one process-wide copy, raw GeoJSON kept on disk across restarts
+DELHI_GEOJSON_URL = "https://raw.githubusercontent.com/shuklaneerajdev/IndiaStateTopojsonFiles/master/Delhi.geojson"
+
+@st.cache_resource(show_spinner=False)
 def load_delhi_boundary_from_url():
-    url = "https://raw.githubusercontent.com/shuklaneerajdev/IndiaStateTopojsonFiles/master/Delhi.geojson"
+    """Returns (gdf, polygon). Raises on failure so a transient error is not cached for the process lifetime."""
+    cache = get_disk_cache()
+    raw = cache.get(DELHI_GEOJSON_URL)
+    from_network = raw is None
+    if from_network:
+        response = get_http_session().get(DELHI_GEOJSON_URL, timeout=30)
+        response.raise_for_status()
+        raw = response.content
     try:
-        gdf = gpd.read_file(url)
+        gdf = gpd.read_file(io.BytesIO(raw))
         if gdf.crs is None:
             gdf = gdf.set_crs("EPSG:4326")
         elif gdf.crs.to_epsg() != 4326:
             gdf = gdf.to_crs("EPSG:4326")
         polygon = gdf.unary_union
-        return gdf, polygon
+    except Exception:
+        # Never keep bytes that do not parse (captive-portal HTML, truncated body): the next attempt re-downloads
+        cache.delete(DELHI_GEOJSON_URL)
+        raise
+    if from_network:
+        cache.set(DELHI_GEOJSON_URL, raw)  # static boundary, stored only once it parses: no expiry
+    return gdf, polygon
+
+# After a failed download, reruns skip the (up to 3 x 30 s) fetch for this long instead of retrying every time
+DELHI_BOUNDARY_RETRY_SECONDS = 300
+
+@st.cache_resource
+def get_boundary_failure():
+    """Process-wide record of the last failed boundary load: {"at": timestamp, "error": message}."""
+    return {"at": None, "error": None}
+
+def load_delhi_boundary():
+    """Returns (gdf, polygon), raising without touching the network while a recent failure is on record."""
+    failure = get_boundary_failure()
+    failed_at = failure["at"]
+    if failed_at is not None and time.time() - failed_at < DELHI_BOUNDARY_RETRY_SECONDS:
+        raise RuntimeError(f"{failure['error']} (retrying in {DELHI_BOUNDARY_RETRY_SECONDS - int(time.time() - failed_at)} s)")
+    try:
+        result = load_delhi_boundary_from_url()
     except Exception as e:
-        st.error(f"Failed to load Delhi polygon: {e}")
-        return None, None
-
-if "delhi_gdf" not in st.session_state or "delhi_polygon" not in st.session_state:
-    gdf, polygon = load_delhi_boundary_from_url()
-    st.session_state["delhi_gdf"] = gdf
-    st.session_state["delhi_polygon"] = polygon
-
-# --------- Data fetchers (unchanged)
-@st.cache_data(ttl=600, show_spinner="Fetching Air Quality Data...")
+        failure["at"], failure["error"] = time.time(), str(e)
+        raise
+    failure["at"] = failure["error"] = None
+    return result
+
+try:
+    DELHI_GDF, DELHI_POLYGON = load_delhi_boundary()
+except Exception as e:
+    st.error(f"Failed to load Delhi polygon: {e}")
+    DELHI_GDF, DELHI_POLYGON = None, None
+
+# --------- Data fetchers
+def _first_present(df, columns):
+    """First non-null value across the given (possibly absent) columns, 'N/A' if none."""
+    present = [c for c in columns if c in df.columns]
+    if not present:
+        return 'N/A'
+    values = df[present[0]]
+    for c in present[1:]:
+        values = values.combine_first(df[c])
+    return values.fillna('N/A')
+
+# Short in-memory TTL: freshness is enforced by cached_get_json, this only memoizes post-processing.
+# cache_resource hands every rerun the same DataFrame without a pickle round-trip -- callers must not mutate it.
+@st.cache_resource(ttl=60, show_spinner="Fetching Air Quality Data...")
 def fetch_live_data():
     url = f"https://api.waqi.info/map/bounds/?latlng={DELHI_BOUNDS}&token={API_TOKEN}"
     try:
-        response = requests.get(url, timeout=15)
-        response.raise_for_status()
-        data = response.json()
+        data = cached_get_json(url, ttl=600, timeout=15)
         if data.get("status") == "ok":
-            df = pd.DataFrame(data["data"])
-            df = df[df['aqi'] != "-"]
-            df['aqi'] = pd.to_numeric(df['aqi'], errors='coerce')
-            df = df.dropna(subset=['aqi'])
-            # Robust extract
-            def safe_get_name(x):
-                if isinstance(x, dict):
-                    return x.get('name', 'N/A')
-                elif isinstance(x, str):
-                    return x
-                else:
-                    return 'N/A'
-            def safe_get_time(x):
-                if isinstance(x, dict):
-                    time_data = x.get('time', {})
-                    if isinstance(time_data, dict):
-                        return time_data.get('s', 'N/A')
-                    elif isinstance(time_data, str):
-                        return time_data
-                    else:
-                        return 'N/A'
-                else:
-                    return 'N/A'
-            df['station_name'] = df['station'].apply(safe_get_name)
-            df['last_updated'] = df['station'].apply(safe_get_time)
-            df[['category', 'color', 'emoji', 'advice']] = df['aqi'].apply(get_aqi_category).apply(pd.Series)
-            df['lat'] = pd.to_numeric(df['lat'], errors='coerce')
-            df['lon'] = pd.to_numeric(df['lon'], errors='coerce')
-            df = df.dropna(subset=['lat', 'lon'])
+            # json_normalize flattens the nested station payload in one pass: station.name, station.time[.s]
+            df = pd.json_normalize(data["data"])
+            df['station_name'] = _first_present(df, ['station.name', 'station'])
+            df['last_updated'] = _first_present(df, ['station.time.s', 'station.time'])
+            # "-" and other non-numeric readings become NaN and are dropped with missing coordinates
+            df[['aqi', 'lat', 'lon']] = df[['aqi', 'lat', 'lon']].apply(pd.to_numeric, errors='coerce')
+            df = df.dropna(subset=['aqi', 'lat', 'lon'])
+            idx = aqi_category_index(df['aqi'].to_numpy())
+            # Categoricals keep int8 codes instead of one Python string per row
+            df['category'] = pd.Categorical.from_codes(idx, categories=_AQI_NAMES.tolist())
+            df['color'] = _AQI_COLORS[idx].tolist()
+            df['emoji'] = pd.Categorical.from_codes(idx, categories=_AQI_EMOJI.tolist())
+            df['advice'] = pd.Categorical.from_codes(idx, categories=_AQI_ADVICE.tolist())
+            # float32 is ample for display (AQI 0-500, Delhi lat/lon); station frames passed to kriging are cast
+            # back to float64 so the covariance solve does not run in single precision
+            df[['aqi', 'lat', 'lon']] = df[['aqi', 'lat', 'lon']].astype('float32')
             return df
         return pd.DataFrame()
     except Exception:
         return pd.DataFrame()
 
-@st.cache_data(ttl=1800, show_spinner="Fetching Weather Data...")
+@st.cache_data(ttl=300, show_spinner=False)
 def fetch_weather_data():
+    """Returns (temperature, weathercode) for central Delhi; "N/A" for anything unavailable."""
     url = f"https://api.open-meteo.com/v1/forecast?latitude={DELHI_LAT}&longitude={DELHI_LON}&current_weather=true&timezone=Asia/Kolkata"
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return response.json()
+        current = cached_get_json(url, ttl=1800, timeout=10).get("current_weather") or {}
     except Exception:
-        return None
+        current = {}
+    # Only the two fields the SMS uses are cached, not the whole Open-Meteo payload
+    return current.get("temperature", "N/A"), current.get("weathercode", "N/A")
 
 # -------------------------
 # AQI category -- fixed hazardous color to black circle
 # -------------------------
+# Single source of truth for AQI categories: (name, inclusive upper bound, RGB, emoji, advice).
+# Hazardous uses a black circle emoji and black RGB for UI markers.
+AQI_LEVELS = (
+    ("Good", 50, (0, 158, 96), "✅", "Enjoy outdoor activities."),
+    ("Moderate", 100, (255, 214, 0), "🟡", "Unusually sensitive people should consider reducing prolonged or heavy exertion."),
+    ("Unhealthy for Sensitive Groups", 150, (249, 115, 22), "🟠", "Sensitive groups should reduce prolonged or heavy exertion."),
+    ("Unhealthy", 200, (220, 38, 38), "🔴", "Everyone may begin to experience health effects."),
+    ("Very Unhealthy", 300, (147, 51, 234), "🟣", "Health alert: everyone may experience more serious health effects."),
+    ("Hazardous", np.inf, (0, 0, 0), "⚫", "Health warnings of emergency conditions. The entire population is more likely to be affected."),
+)
+
+# Module-level lookup arrays (rebuilt per script run, not per call); searchsorted only needs the finite bounds
+_AQI_BOUNDS = np.array([level[1] for level in AQI_LEVELS[:-1]], dtype=float)
+_AQI_NAMES = np.array([level[0] for level in AQI_LEVELS], dtype=object)
+_AQI_COLORS = np.array([level[2] for level in AQI_LEVELS], dtype=np.uint8)
+_AQI_EMOJI = np.array([level[3] for level in AQI_LEVELS], dtype=object)
+_AQI_ADVICE = np.array([level[4] for level in AQI_LEVELS], dtype=object)
+_AQI_HEX_SCALE = ["#%02X%02X%02X" % level[2] for level in AQI_LEVELS]
+
+def aqi_category_index(aqi_values):
+    """Vectorized lookup: index into the _AQI_* tables for each AQI value."""
+    return np.searchsorted(_AQI_BOUNDS, np.asarray(aqi_values, dtype=float), side="left")
+
+# Scalar path: module-level immutable per-category results (rebuilt per script run, not per call),
+# returned by index without per-call allocation
+_AQI_ENTRIES = tuple((name, color, emoji, advice) for name, _, color, emoji, advice in AQI_LEVELS)
+_AQI_UPPER_BOUNDS = tuple(level[1] for level in AQI_LEVELS[:-1])
+
 def get_aqi_category(aqi):
-    """Categorizes AQI value and provides color, emoji, and health advice."""
+    """Categorizes AQI value and provides color (RGB tuple), emoji, and health advice."""
     a = float(aqi)
-    if a <= 50:
-        return "Good", [0, 158, 96], "✅", "Enjoy outdoor activities."
-    elif a <= 100:
-        return "Moderate", [255, 214, 0], "🟡", "Unusually sensitive people should consider reducing prolonged or heavy exertion."
-    elif a <= 150:
-        return "Unhealthy for Sensitive Groups", [249, 115, 22], "🟠", "Sensitive groups should reduce prolonged or heavy exertion."
-    elif a <= 200:
-        return "Unhealthy", [220, 38, 38], "🔴", "Everyone may begin to experience health effects."
-    elif a <= 300:
-        return "Very Unhealthy", [147, 51, 234], "🟣", "Health alert: everyone may experience more serious health effects."
-    else:
-        # Hazardous: use black circle emoji and black RGB for UI markers
-        return "Hazardous", [0, 0, 0], "⚫", "Health warnings of emergency conditions. The entire population is more likely to be affected."
+    if a != a:
+        # NaN sorts past every bound (Hazardous), matching the vectorized lookup
+        return _AQI_ENTRIES[-1]
+    # bisect_left == searchsorted(side="left"): a value equal to a bound stays in the lower category
+    return _AQI_ENTRIES[bisect.bisect_left(_AQI_UPPER_BOUNDS, a)]
 
 # -------------------------
 # Remaining UI and functions (kept from your original script)
@@ -271,25 +437,36 @@ def render_header(df):
     last_update_time = df['last_updated'].max() if not df.empty and 'last_updated' in df.columns else "N/A"
     st.markdown(f'<div style="text-align:center; color: #555;">Last updated: {last_update_time}</div>', unsafe_allow_html=True)
     if not df.empty:
+        aqi = df['aqi'].to_numpy()
+        i_min, i_max = int(aqi.argmin()), int(aqi.argmax())
         c1, c2, c3 = st.columns(3)
         with c1:
-            st.metric("Average AQI", f"{df['aqi'].mean():.1f}")
+            st.metric("Average AQI", f"{aqi.mean():.1f}")
         with c2:
-            st.metric("Min AQI", f"{df['aqi'].min():.0f}", df.loc[df['aqi'].idxmin()]['station_name'])
+            st.metric("Min AQI", f"{aqi[i_min]:.0f}", df['station_name'].iloc[i_min])
         with c3:
-            st.metric("Max AQI", f"{df['aqi'].max():.0f}", df.loc[df['aqi'].idxmax()]['station_name'])
+            st.metric("Max AQI", f"{aqi[i_max]:.0f}", df['station_name'].iloc[i_max])
+
 
+@st.cache_resource(ttl=600, show_spinner=False)
+def build_station_deck(data_key, _layer_df):
+    """pydeck Deck for the station layer, reused across reruns while data_key (a content hash) is unchanged."""
+    return pdk.Deck(
+        initial_view_state=pdk.ViewState(latitude=DELHI_LAT, longitude=DELHI_LON, zoom=9.5),
+        layers=[pdk.Layer("ScatterplotLayer", data=_layer_df, get_position='[lon, lat]', get_fill_color='color', get_radius=250)],
+        tooltip={"html": "<b>{station_name}</b><br/>AQI: {aqi}", "style": {"color": "white"}}
+    )
 
 def render_map_tab(df):
     st.subheader("📍 Live Map")
     if df.empty:
         st.warning("No data")
         return
-    st.pydeck_chart(pdk.Deck(
-        initial_view_state=pdk.ViewState(latitude=DELHI_LAT, longitude=DELHI_LON, zoom=9.5),
-        layers=[pdk.Layer("ScatterplotLayer", data=df, get_position='[lon, lat]', get_fill_color='color', get_radius=250)],
-        tooltip={"html": "<b>{station_name}</b><br/>AQI: {aqi}", "style": {"color": "white"}}
-    ))
+    # Only ship the columns the layer and tooltip read; pydeck serializes every column it is given
+    layer_df = df[['lon', 'lat', 'color', 'station_name', 'aqi']]
+    # color is derived from aqi, so hashing the scalar columns identifies the layer data
+    data_key = int(pd.util.hash_pandas_object(layer_df[['lon', 'lat', 'station_name', 'aqi']], index=False).sum())
+    st.pydeck_chart(build_station_deck(data_key, layer_df))
 
 def render_alerts_tab(df):
     st.subheader("🔔 Alerts & Health Advice")
@@ -300,6 +477,54 @@ def render_alerts_tab(df):
     _, _, emoji, advice = get_aqi_category(max_aqi)
     st.info(f"{emoji} Current highest AQI: {max_aqi:.0f} — {advice}")
 
+# Kriging grid extent (lat_min, lat_max, lon_min, lon_max)
+KRIGING_BOUNDS = (28.40, 28.88, 76.84, 77.35)
+# One resolution for the heatmap and the SMS lookup so both share a single cached kriging solve
+KRIGING_RESOLUTION = 250
+
+@st.cache_data(ttl=600, show_spinner="Running kriging interpolation...")
+def run_kriging(station_df, bounds, resolution, _polygon=None):
+    """Cached perform_kriging_correct: identical station inputs skip the O(N^3) solve on reruns."""
+    return perform_kriging_correct(station_df, bounds, polygon=_polygon, resolution=resolution)
+
+# cache_resource, not cache_data: unpickling a plotly figure rebuilds and re-validates every cell.
+# Every rerun gets the same Figure object -- callers must not mutate it.
+@st.cache_resource(ttl=600, show_spinner=False)
+def build_kriging_figure(station_df, bounds, resolution, _polygon=None):
+    """Heatmap figure for a kriging grid, keyed on the (small) station frame rather than the grid itself."""
+    lon_grid, lat_grid, z = run_kriging(station_df, bounds, resolution, _polygon=_polygon)
+    # Mask first (cells outside Delhi are NaN / masked) so only valid cells are copied into the frame
+    z = np.ma.filled(z, np.nan)
+    valid = ~np.isnan(z)
+    heatmap_df = pd.DataFrame({"lon": lon_grid[valid], "lat": lat_grid[valid], "aqi": z[valid]}, dtype=np.float32)
+    return px.density_mapbox(heatmap_df, lat="lat", lon="lon", z="aqi", radius=12, center=dict(lat=DELHI_LAT, lon=DELHI_LON), zoom=9.5, mapbox_style="carto-positron", color_continuous_scale=_AQI_HEX_SCALE, range_color=[0,500])
+
+@st.cache_resource(ttl=600, show_spinner=False)
+def build_kriging_lookup(station_df, bounds, resolution, _polygon=None):
+    """
+    KD-tree over the kriging grid cells, the flattened z values and the largest
+    query distance (one cell diagonal), built once per station snapshot.
+    """
+    lon_grid, lat_grid, z = run_kriging(station_df, bounds, resolution, _polygon=_polygon)
+    tree = cKDTree(np.column_stack([np.ravel(lon_grid), np.ravel(lat_grid)]))
+    # Spacing comes from the grid the solver actually returned, not from bounds/resolution
+    lon_grid, lat_grid = np.asarray(lon_grid), np.asarray(lat_grid)
+    lon_step = np.ptp(lon_grid) / max(lon_grid.shape[-1] - 1, 1)
+    lat_step = np.ptp(lat_grid) / max(lat_grid.shape[0] - 1, 1)
+    cell_diagonal = float(np.hypot(lon_step, lat_step))
+    z_flat = np.ma.filled(np.ravel(z), np.nan).astype(float)
+    return tree, z_flat, cell_diagonal
+
+def lookup_grid_aqi(lat, lon, tree, z_flat, max_distance):
+    """
+    Interpolated AQI at the nearest grid cell (O(log N) tree query).
+    NaN when no cell lies within max_distance (point off the grid) or the cell is outside Delhi.
+    """
+    _, i = tree.query([lon, lat], distance_upper_bound=max_distance)
+    if i == tree.n:
+        return np.nan
+    return float(z_flat[i])
+
 # Kriging tab (kept as-is but with guard)
 def render_kriging_tab(df):
     st.subheader("🔥 Kriging Heatmap (Spatial Interpolation)")
@@ -307,11 +532,9 @@ def render_kriging_tab(df):
         st.warning("Not enough stations for kriging.")
         return
     try:
-        delhi_polygon = st.session_state.get("delhi_polygon", None)
-        lon_grid, lat_grid, z = perform_kriging_correct(df, (28.40, 28.88, 76.84, 77.35), polygon=delhi_polygon, resolution=250)
-        st.session_state["kriging_output"] = (lon_grid, lat_grid, z)
-        heatmap_df = pd.DataFrame({"lon": lon_grid.flatten(), "lat": lat_grid.flatten(), "aqi": z.flatten()}).dropna()
-        fig = px.density_mapbox(heatmap_df, lat="lat", lon="lon", z="aqi", radius=12, center=dict(lat=DELHI_LAT, lon=DELHI_LON), zoom=9.5, mapbox_style="carto-positron", color_continuous_scale=["#009E60","#FFD600","#F97316","#DC2626","#9333EA","#000000"], range_color=[0,500])
+        delhi_polygon = DELHI_POLYGON
+        station_df = df[['lat', 'lon', 'aqi']].astype('float64')
+        fig = build_kriging_figure(station_df, KRIGING_BOUNDS, KRIGING_RESOLUTION, _polygon=delhi_polygon)
         st.plotly_chart(fig, use_container_width=True)
     except Exception as e:
         st.error(f"Kriging failed: {str(e)}")
@@ -323,28 +546,21 @@ def render_kriging_tab(df):
 def render_alert_subscription_tab(df):
     st.subheader("📩 Real-Time AQI Alerts (via SMS)")
 
-    polygon = st.session_state.get("delhi_polygon", None)
+    polygon = DELHI_POLYGON
     if polygon is None:
         st.error("Delhi polygon not loaded.")
         return
 
-    # Ensure kriging data exists; generate if needed
-    kriging_data = st.session_state.get("kriging_output", None)
-    if kriging_data is None:
-        if df.empty or len(df) < 3:
-            st.error("Not enough stations to compute interpolated AQI for alerts (min 3 required).")
+    if df.empty or len(df) < 3:
+        st.error("Not enough stations to compute interpolated AQI for alerts (min 3 required).")
+        return
+    with st.spinner("Generating interpolation for alerts..."):
+        try:
+            kriging_tree, z_flat, max_distance = build_kriging_lookup(df[['lat', 'lon', 'aqi']].astype('float64'), KRIGING_BOUNDS, KRIGING_RESOLUTION, _polygon=polygon)
+        except Exception as e:
+            st.error("Could not create kriging output.")
+            st.code(traceback.format_exc())
             return
-        with st.spinner("Generating interpolation for alerts..."):
-            try:
-                lon_grid, lat_grid, z_grid = perform_kriging_correct(df, (28.40, 28.88, 76.84, 77.35), polygon=polygon, resolution=200)
-                st.session_state["kriging_output"] = (lon_grid, lat_grid, z_grid)
-                kriging_data = (lon_grid, lat_grid, z_grid)
-            except Exception as e:
-                st.error("Could not create kriging output.")
-                st.code(traceback.format_exc())
-                return
-
-    lon_grid, lat_grid, z_grid = kriging_data
 
     st.markdown("### Select notification location")
     mode = st.radio("How to specify location:", ["Select from list", "Enter coordinates"], horizontal=True)
@@ -359,7 +575,7 @@ def render_alert_subscription_tab(df):
             "Dwarka": (28.5921, 77.0460)
         }
         # Add monitoring stations
-        station_choices = {f"{r['station_name']} (AQI {r['aqi']:.0f})": (r['lat'], r['lon']) for _, r in df.iterrows()}
+        station_choices = {f"{name} (AQI {aqi:.0f})": (lat, lon) for name, aqi, lat, lon in zip(df['station_name'].to_numpy(), df['aqi'].to_numpy(), df['lat'].to_numpy(), df['lon'].to_numpy())}
         all_choices = {**presets, **station_choices}
         choice = st.selectbox("Choose location", options=list(all_choices.keys()))
         user_lat, user_lon = all_choices[choice]
@@ -389,51 +605,53 @@ def render_alert_subscription_tab(df):
 
         # Get interpolated AQI for user location
         try:
-            aqi_val, outside = get_aqi_at_location(user_lat, user_lon, lat_grid, lon_grid, z_grid, polygon)
+            aqi_val = lookup_grid_aqi(user_lat, user_lon, kriging_tree, z_flat, max_distance)
         except Exception as e:
             st.error("Failed to compute interpolated AQI.")
             st.code(traceback.format_exc())
             return
 
         if np.isnan(aqi_val):
-            st.error("Could not determine AQI for this location. Try another location.")
+            st.error("Could not determine AQI for this location. Pick a location inside Delhi.")
             return
 
-        # Compose message
         category, color_rgb, emoji, advice = get_aqi_category(aqi_val)
-        weather_json = fetch_weather_data()
-        if weather_json and "current_weather" in weather_json:
-            weather_desc = weather_json["current_weather"].get("weathercode", "N/A")
-            temp = weather_json["current_weather"].get("temperature", "N/A")
+
+        # Short-circuit: while the number is throttled skip weather lookup, message composition and the send
+        wait_secs = sms_throttle_remaining(phone_input)
+        if wait_secs:
+            provider = "throttle"
+            resp_text = f"Throttled: Please wait {wait_secs} seconds before requesting another SMS to this number."
+            st.warning(resp_text)
         else:
-            weather_desc = "N/A"
-            temp = "N/A"
-
-        # build human-friendly message (short)
-        send_time = datetime.now().strftime("%Y-%m-%d %H:%M")
-        message = (f"Delhi AQI Alert ({send_time})\n"
-                   f"Location: {user_lat:.4f}, {user_lon:.4f}\n"
-                   f"{emoji} AQI: {aqi_val:.0f} ({category})\n"
-                   f"Temp: {temp}°C • Weather: {weather_desc}\n"
-                   f"Advice: {advice}\n"
-                   f"Source: Interpolated AQI from local monitoring stations.")
-
-        # Attempt to send SMS using wrapper
-        with st.spinner("Sending SMS..."):
-            success, provider, resp_text = send_sms(phone_input, message)
-            if success:
-                st.success(f"SMS sent successfully via {provider}.")
-            else:
-                # Detailed human-friendly error
-                if provider == "validation":
-                    st.error(f"Phone validation failed: {resp_text}")
-                elif provider == "throttle":
-                    st.warning(resp_text)
-                elif provider in ("sms77_failed", "sms77", "both_failed", "twilio"):
-                    st.warning(f"SMS sending failed ({provider}): {resp_text}")
-                    st.info("Showing the alert here (SMS failed).")
+            # Compose message
+            temp, weather_desc = fetch_weather_data()
+
+            # build human-friendly message (short)
+            send_time = datetime.now().strftime("%Y-%m-%d %H:%M")
+            message = (f"Delhi AQI Alert ({send_time})\n"
+                       f"Location: {user_lat:.4f}, {user_lon:.4f}\n"
+                       f"{emoji} AQI: {aqi_val:.0f} ({category})\n"
+                       f"Temp: {temp}°C • Weather: {weather_desc}\n"
+                       f"Advice: {advice}\n"
+                       f"Source: Interpolated AQI from local monitoring stations.")
+
+            # Attempt to send SMS using wrapper
+            with st.spinner("Sending SMS..."):
+                success, provider, resp_text = send_sms(phone_input, message)
+                if success:
+                    st.success(f"SMS sent successfully via {provider}.")
                 else:
-                    st.error(f"SMS error ({provider}): {resp_text}")
+                    # Detailed human-friendly error
+                    if provider == "validation":
+                        st.error(f"Phone validation failed: {resp_text}")
+                    elif provider == "throttle":
+                        st.warning(resp_text)
+                    elif provider in ("sms77_failed", "sms77", "both_failed", "twilio"):
+                        st.warning(f"SMS sending failed ({provider}): {resp_text}")
+                        st.info("Showing the alert here (SMS failed).")
+                    else:
+                        st.error(f"SMS error ({provider}): {resp_text}")
 
         # Always display the alert on screen (even if SMS failed)
         st.markdown("---")
@@ -446,11 +664,16 @@ def render_alert_subscription_tab(df):
 # -------------------------
 # Remaining tabs + main
 # -------------------------
+@st.cache_resource
+def get_forecast_rng():
+    """Process-wide numpy Generator for the simulated forecast noise (seeded once, not on every rerun)."""
+    return np.random.default_rng()
+
 def render_dummy_forecast_tab():
     st.subheader("Forecast (Simulated)")
     hours = np.arange(0, 24)
-    base_aqi = 120 + 40 * np.sin(hours / 3) + np.random.normal(0, 5, size=24)
-    timestamps = [datetime.now() + timedelta(hours=i) for i in range(24)]
+    base_aqi = 120 + 40 * np.sin(hours / 3) + get_forecast_rng().normal(0, 5, size=24)
+    timestamps = pd.date_range(start=pd.Timestamp.now(), periods=24, freq="h")
     forecast_df = pd.DataFrame({"timestamp": timestamps, "forecast_aqi": np.clip(base_aqi, 40, 300)})
     fig = px.line(forecast_df, x="timestamp", y="forecast_aqi", title="24h Forecast (Simulated)", markers=True)
     st.plotly_chart(fig, use_container_width=True)
@@ -460,7 +683,8 @@ def render_analytics_tab(df):
     if df.empty:
         st.info("No data")
         return
-    fig = px.pie(values=df['aqi'].value_counts().values, names=df['aqi'].value_counts().index)
+    counts = df['aqi'].value_counts()
+    fig = px.pie(values=counts.values, names=counts.index)
     st.plotly_chart(fig)
 
 # -------------------------
@@ -472,18 +696,12 @@ if aqi_data_raw.empty:
     st.error("Could not fetch live AQI data. Check API key or network.")
     render_header(aqi_data_raw)
 else:
-    # Clip to Delhi geometry if available
-    delhi_polygon = st.session_state.get("delhi_polygon", None)
+    # Clip to Delhi geometry if available: a vectorized point-in-polygon mask (boundary points kept, as gpd.clip did)
     aqi_display_df = aqi_data_raw
-    if delhi_polygon is not None and not aqi_data_raw.empty:
-        try:
-            geometry = [Point(xy) for xy in zip(aqi_data_raw['lon'], aqi_data_raw['lat'])]
-            stations_gdf = gpd.GeoDataFrame(aqi_data_raw, crs="epsg:4326", geometry=geometry)
-            clipped = gpd.clip(stations_gdf, delhi_polygon)
-            if not clipped.empty:
-                aqi_display_df = pd.DataFrame(clipped.drop(columns='geometry'))
-        except Exception:
-            aqi_display_df = aqi_data_raw
+    if DELHI_POLYGON is not None:
+        inside = shapely.intersects_xy(DELHI_POLYGON, aqi_data_raw['lon'].to_numpy(), aqi_data_raw['lat'].to_numpy())
+        if inside.any():
+            aqi_display_df = aqi_data_raw.loc[inside]
 
     render_header(aqi_display_df)
 